@@ -5,93 +5,106 @@ import sys
 import logging
 from datetime import datetime
 import time
+import random
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 
+import numpy as np
 import geopandas as gpd
+import pyogrio
+import shapely
 from shapely.geometry import shape
-from shapely.geometry import Polygon
-from shapely.geometry import Point
-from shapely import wkt
-from shapely.geometry import JOIN_STYLE
-import matplotlib.pyplot as plt 
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Use 'pyogrio' for all GeoDataFrame IO (vectorized, Arrow-backed)
+gpd.options.io_engine = "pyogrio"
+
 # Configuration
 API_URL = "https://deepstatemap.live/api/history/last"
 OUTPUT_DIR = "data"
 OUTPUT_FILENAME = f"deepstatemap_data_{datetime.now().strftime('%Y%m%d')}.geojson"
+TARGET_NAMES = {'CADR and CALR', 'Occupied', 'Occupied Crimea'}
 MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
+BASE_DELAY = 2  # seconds
+MAX_DELAY = 60  # seconds
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows Phone 10.0; Android 6.0.1; Microsoft; RM-1152) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/52.0.2743.116 Mobile Safari/537.36 Edge/15.15254"
+}
+
+# Persistent session, so retries reuse the pooled (keep-alive) connection instead of a new TLS handshake
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+# No adapter-level retries, every failure (connection errors included) is retried with jittered backoff in make_api_request
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+
+
+def get_retry_delay(attempt, response=None):
+    """Return the delay before the next retry (server's Retry-After, otherwise exponential backoff with jitter)."""
+    if response is not None and response.status_code in (429, 503):
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(MAX_DELAY, int(retry_after))
+
+    return min(MAX_DELAY, BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.5)
 
 
 def make_api_request():
     """Make a request to the API and return the JSON response."""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows Phone 10.0; Android 6.0.1; Microsoft; RM-1152) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/52.0.2743.116 Mobile Safari/537.36 Edge/15.15254"
-    }
-    
     for attempt in range(MAX_RETRIES):
         try:
-            response = requests.get(API_URL, headers=headers, timeout=10)
+            response = SESSION.get(API_URL, timeout=10)
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            # Decode raw bytes with 'orjson' (faster than stdlib 'json' on the large payload)
+            return orjson.loads(response.content)
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             logger.warning(f"API request failed (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
             if attempt < MAX_RETRIES - 1:
-                logger.info(f"Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
+                delay = get_retry_delay(attempt, getattr(e, "response", None))
+                logger.info(f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
             else:
                 logger.error("All API request attempts failed.")
                 sys.exit(1)
 
 
 def process_data(data):
-    """Process the API response data."""
-
-    geo_list = []
-    for f in data['map']['features']:
-        geom = f['geometry']
-        name = f['properties']['name']
-        new_feature = {
-            "name":name,
-            "geometry":wkt.loads(wkt.dumps(shape(geom), output_dimension=2))
-            }
-
-        geo_list.append(new_feature)
-        
-    # Split the name by '///' and take the first part
-    def extract_first_part(name, part=0):
-        first_part = name.split('///')[part].strip()
-        return first_part
-    
-    for item in geo_list:
-        item['name'] = extract_first_part(item['name'], part=1)
-    
-    return geo_list
+    """Process the API response data into a GeoDataFrame."""
 
+    features = data['map']['features']
 
-def create_geodataframe(geo_list):
-    """Create a GeoDataFrame from the processed data."""
-    raw_gdf = gpd.GeoDataFrame(geo_list).set_crs(4326)
-    
-    mask = raw_gdf.geometry.apply(lambda x: isinstance(x, Polygon))
-    polygon_gdf = raw_gdf[mask]
-    
-    filtered_gdf = polygon_gdf[polygon_gdf['name'].isin(['CADR and CALR', 'Occupied', 'Occupied Crimea'])].reset_index()
+    # Split the name by '///' and take the second part (one vectorized pass over all names)
+    names = gpd.pd.Series([f['properties']['name'] for f in features]).str.split('///', n=2, expand=True)[1].str.strip()
+
+    # Skip features outside the layers of interest (and non-polygons) before building their geometry
+    is_polygon = np.array([f['geometry']['type'] == "Polygon" for f in features], dtype=bool)
+    keep = names.isin(TARGET_NAMES).to_numpy() & is_polygon
+    geoms = [shape(f['geometry']) for f, k in zip(features, keep) if k]
+
+    # Drop Z coordinates in a single vectorized call
+    geoms = shapely.force_2d(np.asarray(geoms, dtype=object))
+
+    return gpd.GeoDataFrame({'name': names.to_numpy()[keep], 'geometry': geoms}, crs=4326)
+
+
+def create_geodataframe(raw_gdf):
+    """Create a merged, de-artifacted GeoSeries from the processed data."""
     
-    merged_gdf = gpd.GeoSeries(filtered_gdf.union_all(), crs=4326)
+    # Union the polygons of interest (selected in process_data) in a single GEOS call
+    # (GEOS UnaryUnion already cascades the union over an STRtree, so no manual tiling is needed)
+    merged = shapely.unary_union(np.asarray(raw_gdf.geometry.values))
     
     # Applying buffer to remove union artifacts
     eps = 0.000009
 
-    deartifacted_gdf = (
-        merged_gdf
-        .buffer(eps, 1, join_style=JOIN_STYLE.mitre)
-        .buffer(-eps, 1, join_style=JOIN_STYLE.mitre)
+    deartifacted = shapely.buffer(
+        shapely.buffer(merged, eps, quad_segs=1, join_style="mitre"),
+        -eps, quad_segs=1, join_style="mitre"
         )
+    deartifacted_gdf = gpd.GeoSeries([deartifacted], crs=4326)
     
     return deartifacted_gdf
 
@@ -106,16 +119,16 @@ def main():
     
     # Process data
     logger.info("Processing data...")
-    processed_data = process_data(raw_data)
+    raw_gdf = process_data(raw_data)
     
-    # Create GeoDataFrame
-    logger.info("Creating GeoDataFrame...")
-    gdf = create_geodataframe(processed_data)
+    # Merge geometries
+    logger.info("Merging geometries...")
+    gdf = create_geodataframe(raw_gdf)
     
     # Export as GeoJSON
     output_path = os.path.join(OUTPUT_DIR, OUTPUT_FILENAME)
     logger.info(f"Exporting data to {output_path}...")
-    gdf.to_file(output_path, driver="GeoJSON")
+    pyogrio.write_dataframe(gpd.GeoDataFrame(geometry=gdf), output_path, driver="GeoJSON", use_arrow=True)
     
     logger.info("Data update completed successfully.")
 
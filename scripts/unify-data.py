@@ -4,14 +4,19 @@ import os
 import sys
 import logging
 from datetime import datetime
+import re
 import gzip
-from io import StringIO
+import shutil
+import signal
+import subprocess
+import tempfile
+import io
+from contextlib import contextmanager
 
 # Prevent "GDAL_DATA is not defined" warning (has to be set before importing geo libraries)
+# Geo libraries are imported inside the functions that need them, so existence checks exit without loading GDAL
 os.environ['GDAL_DATA'] = os.path.join(f'{os.sep}'.join(sys.executable.split(os.sep)[:-1]), 'Library', 'share', 'gdal')
 
-import geopandas as gpd
-
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,13 +24,15 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 CURRENT_DATE = datetime.now()
-CRS = "EPSG:4326"
 
 SOURCE_FILE = f"deepstatemap_data_{CURRENT_DATE.strftime('%Y%m%d')}.geojson"
 SOURCE_FILE_PATH = os.path.join("data", SOURCE_FILE)
 
 TARGET_FILE = "deepstate-map-data.geojson.gz"
 TARGET_FILE_PATH = os.path.join(TARGET_FILE)
+TMP_TARGET_FILE = f"{TARGET_FILE}.tmp"
+COORDINATE_PRECISION = 15  # decimals, enough to round-trip float64 lon/lat (up to 17 significant digits)
+COMPRESS_LEVEL = 6  # gzip default, considerably faster than 9 for a marginal size difference on JSON
 
 
 def check_source_geojson_existence():
@@ -48,75 +55,121 @@ def check_target_geojson_existence():
         sys.exit(1)
 
 
+def check_target_geojson_format():
+    """Checks if compressed GeoJSON is stored as a GeoJSON Text Sequence (one feature per line)."""
+
+    # Legacy archives hold a single FeatureCollection object, which cannot be appended to
+    with gzip.open(TARGET_FILE_PATH, "rb") as f:
+        head = f.read(64)
+
+    is_sequence = b"FeatureCollection" not in head
+    logger.info(f"Target GeoJSON is stored as {'a GeoJSON Text Sequence' if is_sequence else 'a FeatureCollection'}.")
+    return is_sequence
+
+
+@contextmanager
+def open_target_geojson(bulk_read=False):
+    """Opens compressed GeoJSON as a decompressed binary stream, picking the decoder by access pattern."""
+
+    try:
+        # Parallel gzip decoder (optional)
+        import rapidgzip
+    except ImportError:
+        rapidgzip = None
+
+    if rapidgzip is not None:
+        # Decompress with the parallel 'rapidgzip' decoder using all available cores
+        with rapidgzip.open(TARGET_FILE_PATH, parallelization=os.cpu_count()) as f:
+            # RapidgzipFile is a raw stream: hand it over as is for a single read(), buffer it for line iteration
+            yield f if bulk_read else io.BufferedReader(f, 1 << 20)
+    elif shutil.which("gzip"):
+        # Decompress with the system gzip binary and stream its output through a pipe
+        proc = subprocess.Popen(["gzip", "-dc", TARGET_FILE_PATH], stdout=subprocess.PIPE)
+        try:
+            yield proc.stdout
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        # Ensure the archive was decompressed without errors (SIGPIPE only means the reader stopped early)
+        if proc.returncode not in (0, -signal.SIGPIPE):
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    else:
+        logger.warning("Could not find 'rapidgzip' or 'gzip' binary, switching to Python 'gzip' module...")
+        with gzip.open(TARGET_FILE_PATH, "rb") as f:
+            yield f
+
+
+def check_update_existence():
+    """Checks if compressed GeoJSON already contains current update, without parsing any geometries."""
+
+    # Match the raw 'date' property of each record (one feature per line)
+    date_pattern = re.compile(rb'"date":\s*"' + CURRENT_DATE.strftime('%Y-%m-%d').encode() + rb'"')
+
+    try:
+        with open_target_geojson() as f:
+            for line in f:
+                if date_pattern.search(line):
+                    logger.warning(f"Exiting because target dataset already contains the {CURRENT_DATE.strftime('%Y-%m-%d')} update.")
+                    sys.exit(0)
+
+    except Exception as e:
+        logger.error(f"Exiting due to error while scanning target GeoJSON: {e}")
+        sys.exit(1)
+
+    logger.info("Current update does not yet exist in the target dataset.")
+
+
 def import_source_geojson():
     """Imports updated GeoJSON geometry into GeoDataFrame"""
 
-    try:
-        # Use 'pyogrio' engine to read geojson (improved performance)
-        new_rows_gdf = gpd.read_file(SOURCE_FILE_PATH, engine="pyogrio")
+    import geopandas as gpd
 
-    except (ValueError, NotImplementedError) as e:
-        logger.warning("Could not use 'pyogrio' engine, switching to 'fiona'...")
-        # Use 'fiona' engine to read geojson (more robust)
-        new_rows_gdf = gpd.read_file(SOURCE_FILE_PATH, engine="fiona")
+    try:
+        # Use 'pyogrio' engine with Arrow to read geojson (vectorized record IO)
+        new_rows_gdf = gpd.read_file(SOURCE_FILE_PATH, engine="pyogrio", use_arrow=True)
 
     except Exception as e:
-        logger.error("Exiting due to error while importing source GeoJSON: {e}")
+        logger.error(f"Exiting due to error while importing source GeoJSON: {e}")
         sys.exit(1)
 
-    # Append dictionary with date and geometry to a list
-    new_rows = []
+    # Validate if source file contains single feature (row)
     if new_rows_gdf.empty:
         logger.warning("Exiting due to empty GeoDataFrame.")
         sys.exit(1)
-    else:
-        new_rows.append({
-            "date": CURRENT_DATE.strftime('%Y-%m-%d'),
-            "geometry": new_rows_gdf.geometry.iloc[0]
-        })
-        # Validate if source file contains single feature (row)
-        if new_rows_gdf.shape[0] > 1:
-            logger.error(f"Exiting because expected 1 feature, but source GeoJSON contains {new_rows_gdf.shape[0]}.")
-            sys.exit(1)
+    elif new_rows_gdf.shape[0] > 1:
+        logger.error(f"Exiting because expected 1 feature, but source GeoJSON contains {new_rows_gdf.shape[0]}.")
+        sys.exit(1)
 
-    try:
-        # Convert list of dictionaries into GeoDataFrame  
-        source_gdf = gpd.GeoDataFrame(new_rows, geometry="geometry", crs=CRS)
-        logger.info(f"Successfully imported {source_gdf.shape[0]} feature(-s) into GeoDataFrame. Update for {CURRENT_DATE.strftime('%Y-%m-%d')}.")
-        return source_gdf
+    # Keep the imported frame (geometry and CRS) and attach the update date
+    source_gdf = new_rows_gdf[["geometry"]].copy()
+    source_gdf.insert(0, "date", CURRENT_DATE.strftime('%Y-%m-%d'))
+    logger.info(f"Successfully imported {source_gdf.shape[0]} feature(-s) into GeoDataFrame. Update for {CURRENT_DATE.strftime('%Y-%m-%d')}.")
 
-    except Exception as e:
-        logger.error(f"Exiting due to an error while loading dictionary into GeoDataFrame: {e}")
-        sys.exit(1)
+    return source_gdf
 
 
 def import_target_geojson():
     """Imports compressed GeoJSON with consolidated records into GeoDataFrame."""
 
-    # Store target (compressed) GeaJSON contents as GeoJSON string
-    with gzip.open(TARGET_FILE_PATH, "rt", encoding="utf-8") as f:
-        geojson_str = f.read()
-        
-    try:
-        # Use 'pyogrio' engine to read geojson (improved performance)
-        target_gdf = gpd.read_file(StringIO(geojson_str), engine="pyogrio")
+    import geopandas as gpd
+    import pyogrio
 
-    except (ValueError, NotImplementedError) as e:
-        logger.warning("Could not use 'pyogrio' engine, switching to 'fiona'...")
-        # Use 'fiona' engine to read geojson (more robust)
-        target_gdf = gpd.read_file(StringIO(geojson_str), engine="fiona")
+    try:
+        # Use 'pyogrio' with Arrow to read geojson straight from the decompressed stream
+        with open_target_geojson(bulk_read=True) as f:
+            target_gdf = pyogrio.read_dataframe(f, use_arrow=True)
 
     except Exception as e:
-        logger.error("Exiting due to error while importing source GeoJSON: {e}")
+        logger.error(f"Exiting due to error while importing target GeoJSON: {e}")
         sys.exit(1)
 
-    logger.info(f"Successfully imported target GeoJSON. Last update: {target_gdf.tail(1)["date"]}. Current GeoDataFrame shape: {target_gdf.shape}.")
+    logger.info(f"Successfully imported target GeoJSON. Last update: {target_gdf.tail(1)['date']}. Current GeoDataFrame shape: {target_gdf.shape}.")
 
-    # Avoid formatting date as datetime 
-    target_gdf['date'] = target_gdf['date'].dt.strftime('%Y-%m-%d')
+    # Avoid formatting date as datetime (Arrow may yield either datetime64 or date objects)
+    target_gdf['date'] = gpd.pd.to_datetime(target_gdf['date']).dt.strftime('%Y-%m-%d')
 
-    # Drop id column
-    target_gdf = target_gdf.drop(columns="id")
+    # Drop id column (only present in legacy records)
+    target_gdf = target_gdf.drop(columns="id", errors="ignore")
 
     return target_gdf
 
@@ -124,43 +177,67 @@ def import_target_geojson():
 def unify_datasets(existing_dataset, new_row):
     """Concatenates target (multiple geometries) and source (single geometry) GeoDataFrames."""
 
-    # Check if 'last' date values match in both GeoDataFrames 
-    if new_row.iloc[-1].loc["date"] in existing_dataset["date"].values:
-        logger.warning(f"Exiting because target dataset already contains the {CURRENT_DATE.strftime('%Y-%m-%d')} update.")
-        sys.exit(0)  
-    else:
-        logger.info("Current update does not yet exist in the target dataset.")
-        try:
-            # Ensure a natural continuation of index for new data
-            new_row.index = [existing_dataset.index.max() + 1]
-            # Concatenate 2 datasets (update appends to the bottom/end of the target)
-            unified_gdf = gpd.pd.concat(
-                [existing_dataset, new_row],
-                ignore_index=False,
-                copy=False
-                )
-            logger.info(f"Successfully concatenated the existing and new data. New GeoDataFrame shape: {unified_gdf.shape}.")
-            return unified_gdf
-        
-        except Exception as e:
-            logger.error(f"Exiting due to error during GeoDataFrames concatenation: {e}")
-            sys.exit(1)
+    import geopandas as gpd
 
+    # Duplicate dates are already ruled out by check_update_existence before any import
+    try:
+        # Ensure a natural continuation of index for new data
+        new_row.index = [existing_dataset.index.max() + 1]
+        # Concatenate 2 datasets (update appends to the bottom/end of the target)
+        unified_gdf = gpd.pd.concat(
+            [existing_dataset, new_row],
+            ignore_index=False,
+            copy=False
+            )
+        logger.info(f"Successfully concatenated the existing and new data. New GeoDataFrame shape: {unified_gdf.shape}.")
+        return unified_gdf
 
-def compress_gdf(unified_gdf):
-    """Converts unified GeoDataFrame into JSON stirng, and writes it into a compressed GeoJSON file."""
+    except Exception as e:
+        logger.error(f"Exiting due to error during GeoDataFrames concatenation: {e}")
+        sys.exit(1)
 
-    # Convert unified GeoDataFrame into a GeoJSON string
-    geojson_str = unified_gdf.to_json()
+
+def compress_gdf(gdf, mode="wb"):
+    """Writes GeoDataFrame as a GeoJSON Text Sequence (mode="wb") or appends it (mode="ab") to a compressed GeoJSON file."""
+
+    import pyogrio
 
     try:
-        # Write GeoJSON string into a gzip compressed file 
-        with gzip.open(TARGET_FILE, "wt", encoding="utf-8") as f:
-            f.write(geojson_str)
-        logger.info(f"Successfully exported '{TARGET_FILE}' to the project root.")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Let GDAL stream newline-delimited GeoJSON features to disk (no in-memory JSON string)
+            tmp_path = os.path.join(tmp_dir, "records.geojsonl")
+            # Keep full coordinate precision (GeoJSONSeq defaults to 7 decimals)
+            pyogrio.write_dataframe(
+                gdf[["date", "geometry"]],
+                tmp_path,
+                driver="GeoJSONSeq",
+                use_arrow=True,
+                layer_options={"COORDINATE_PRECISION": COORDINATE_PRECISION}
+                )
+
+            # Write into a temporary archive next to the target, so a failed write never corrupts it
+            if mode == "ab":
+                # Appending writes a new gzip member, concatenated members still decompress as a single stream
+                shutil.copyfile(TARGET_FILE, TMP_TARGET_FILE)
+
+            with open(tmp_path, "rb") as src, open(TMP_TARGET_FILE, mode) as f:
+                if shutil.which("gzip"):
+                    # Compress with the system gzip binary, reading the records file directly
+                    proc = subprocess.run(["gzip", "-c", f"-{COMPRESS_LEVEL}"], stdin=src, stdout=f)
+                    proc.check_returncode()
+                else:
+                    logger.warning("Could not find 'gzip' binary, switching to Python 'gzip' module...")
+                    with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=COMPRESS_LEVEL) as gz:
+                        shutil.copyfileobj(src, gz)
+
+            # Atomically swap the completed archive into place
+            os.replace(TMP_TARGET_FILE, TARGET_FILE)
+        logger.info(f"Successfully {'appended' if mode == 'ab' else 'exported'} {gdf.shape[0]} feature(-s) to '{TARGET_FILE}' in the project root.")
 
     except Exception as e:
-        logger.warning(f"Exiting due to error while writing GeoJSON string into file: {e}")
+        logger.warning(f"Exiting due to error while writing GeoJSON records into file: {e}")
+        if os.path.exists(TMP_TARGET_FILE):
+            os.remove(TMP_TARGET_FILE)
         sys.exit(1)
 
 
@@ -174,21 +251,34 @@ def main():
     logger.info("Checking if target GeoJSON exists...")
     check_target_geojson_existence()
     
-    # Import source data
-    logger.info("Importing source GeoJSON...")
-    new_row = import_source_geojson()
-    
-    # Import target data
-    logger.info("Importing target GeoJSON...")
-    existing_dataset = import_target_geojson()
-    
-    # Concatenate dataests into a single GeoDataFrame
-    logger.info("Concatenating source and target datasets...")
-    unified_gdf = unify_datasets(existing_dataset, new_row)
-    
-    # Export unified dataset into a compressed GeoJSON file
-    logger.info("Exporting unified dataset into a compressed file...")
-    compress_gdf(unified_gdf)
+    # Exit early if current update is already present (avoids importing the whole target)
+    logger.info("Checking if target GeoJSON already contains current update...")
+    check_update_existence()
+
+    if check_target_geojson_format():
+        # Import source data
+        logger.info("Importing source GeoJSON...")
+        new_row = import_source_geojson()
+
+        # Append only the new record to the compressed GeoJSON Text Sequence
+        logger.info("Appending source dataset to the compressed file...")
+        compress_gdf(new_row, mode="ab")
+    else:
+        # Import source data
+        logger.info("Importing source GeoJSON...")
+        new_row = import_source_geojson()
+
+        # Import target data
+        logger.info("Importing target GeoJSON...")
+        existing_dataset = import_target_geojson()
+
+        # Concatenate dataests into a single GeoDataFrame
+        logger.info("Concatenating source and target datasets...")
+        unified_gdf = unify_datasets(existing_dataset, new_row)
+
+        # Rewrite legacy FeatureCollection archive as a GeoJSON Text Sequence
+        logger.info("Exporting unified dataset into a compressed file...")
+        compress_gdf(unified_gdf)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file